@@ -9,33 +9,107 @@ de données cachées en utilisant la méthode LSB.
 
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from pathlib import Path
+import os
+import hashlib
+import tempfile
+import unicodedata
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Activer les optimisations SIMD d'OpenCV et utiliser tous les cœurs disponibles
+cv2.setUseOptimized(True)
+cv2.setNumThreads(os.cpu_count() or 1)
+
+# Répertoire par défaut du cache disque des masques de zones optimales
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "stegamind"
+
+# Version du calcul des masques, incluse dans le nom des fichiers de cache :
+# à incrémenter à chaque changement du calcul ou du format des masques
+MASK_CACHE_VERSION = 2
 
 class ImageAnalyzer:
     """Classe pour analyser une image et trouver les meilleures zones pour la stéganographie LSB."""
     
-    def __init__(self, image_path):
+    def __init__(self, image_path, cache_dir=DEFAULT_CACHE_DIR):
         """
         Initialise l'analyseur avec le chemin de l'image.
         
         Args:
             image_path (str): Chemin vers l'image à analyser
+            cache_dir (str, optional): Répertoire du cache disque des masques
+                (None pour désactiver le cache)
         """
         self.image_path = Path(image_path)
-        self.image = cv2.imread(str(image_path))
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        
+        # Lire le fichier une seule fois : le contenu sert au décodage et, si le
+        # cache est actif, à l'empreinte SHA-256 qui identifie l'image dans le cache
+        if not self.image_path.is_file():
+            raise FileNotFoundError(f"Impossible de charger l'image: {image_path}")
+        image_bytes = np.fromfile(str(self.image_path), dtype=np.uint8)
+        if image_bytes.size == 0:
+            raise FileNotFoundError(f"Impossible de charger l'image: {image_path}")
+        self.image_hash = hashlib.sha256(image_bytes).hexdigest() if self.cache_dir is not None else None
+        self.image = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
         if self.image is None:
             raise FileNotFoundError(f"Impossible de charger l'image: {image_path}")
         
-        # Convertir l'image de BGR à RGB pour l'affichage
-        self.image_rgb = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
-        
-        # Convertir en niveaux de gris pour les analyses de texture
-        self.gray_image = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        # Versions RGB (affichage) et niveaux de gris (analyses) de l'image,
+        # converties à la première utilisation seulement
+        self._image_rgb = None
+        self._gray_image = None
         
         # Dimensions de l'image
-        self.height, self.width = self.gray_image.shape[:2]
+        self.height, self.width = self.image.shape[:2]
+        
+        # Cartes d'analyse déjà calculées, indexées par taille de bloc
+        self._metrics_cache = {}
         
+        # Images intégrales (contours de Canny, niveaux de gris et leurs carrés),
+        # calculées à la première utilisation
+        self._edge_integral = None
+        self._gray_integrals = None
+        
+    @property
+    def image_rgb(self):
+        """np.ndarray: Image convertie de BGR à RGB pour l'affichage."""
+        if self._image_rgb is None:
+            self._image_rgb = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
+        return self._image_rgb
+    
+    @property
+    def gray_image(self):
+        """np.ndarray: Image en niveaux de gris pour les analyses de contours et de texture."""
+        self._ensure_gray_image()
+        return self._gray_image
+    
+    def _ensure_gray_image(self):
+        """Convertit l'image en niveaux de gris si ce n'est pas encore fait."""
+        if self._gray_image is None:
+            self._gray_image = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+    
+    def _block_sums(self, integral, block_size):
+        """
+        Calcule la somme de chaque bloc complet à partir d'une image intégrale.
+        
+        Args:
+            integral (np.ndarray): Image intégrale (taille (hauteur + 1, largeur + 1))
+            block_size (int): Taille des blocs pour l'analyse
+            
+        Returns:
+            np.ndarray: Somme des valeurs de chaque bloc
+        """
+        # Nombre de blocs complets dans chaque dimension
+        h_blocks = self.height // block_size
+        w_blocks = self.width // block_size
+        
+        # Valeurs de l'image intégrale aux coins des blocs : la somme d'un bloc
+        # s'obtient avec quatre lectures, quelle que soit sa taille
+        corners = integral[:h_blocks * block_size + 1:block_size,
+                           :w_blocks * block_size + 1:block_size]
+        return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+    
     def calculate_edge_density(self, block_size=8):
         """
         Calcule la densité des contours de l'image en utilisant le détecteur de Canny.
@@ -47,21 +121,14 @@ class ImageAnalyzer:
         Returns:
             np.ndarray: Carte de chaleur indiquant les densités de contours
         """
-        # Détection des contours avec Canny
-        edges = cv2.Canny(self.gray_image, 100, 200)
+        # Détection des contours avec Canny et image intégrale (une seule fois par image,
+        # en float64 pour éviter tout débordement des sommes sur les grandes images)
+        if self._edge_integral is None:
+            edges = cv2.Canny(self.gray_image, 100, 200)
+            self._edge_integral = cv2.integral(edges, sdepth=cv2.CV_64F)
         
-        # Initialiser la carte de densité
-        h_blocks = self.height // block_size
-        w_blocks = self.width // block_size
-        edge_density_map = np.zeros((h_blocks, w_blocks))
-        
-        # Calculer la densité des contours par bloc
-        for y in range(h_blocks):
-            for x in range(w_blocks):
-                y1, y2 = y * block_size, (y + 1) * block_size
-                x1, x2 = x * block_size, (x + 1) * block_size
-                block = edges[y1:y2, x1:x2]
-                edge_density_map[y, x] = np.sum(block) / (block_size * block_size)
+        block_sums = self._block_sums(self._edge_integral, block_size)
+        edge_density_map = block_sums / (block_size * block_size)
                 
         return edge_density_map
     
@@ -76,85 +143,237 @@ class ImageAnalyzer:
         Returns:
             np.ndarray: Carte de chaleur indiquant la complexité de texture
         """
-        # Initialiser la carte de complexité
-        h_blocks = self.height // block_size
-        w_blocks = self.width // block_size
-        texture_map = np.zeros((h_blocks, w_blocks))
-        
-        # Calculer l'écart type local pour chaque bloc
-        for y in range(h_blocks):
-            for x in range(w_blocks):
-                y1, y2 = y * block_size, (y + 1) * block_size
-                x1, x2 = x * block_size, (x + 1) * block_size
-                block = self.gray_image[y1:y2, x1:x2]
-                texture_map[y, x] = np.std(block)
+        # Images intégrales de x et de x² (une seule fois par image). Les valeurs
+        # sont entières et restent exactes en float64
+        if self._gray_integrals is None:
+            self._gray_integrals = cv2.integral2(self.gray_image, sdepth=cv2.CV_64F,
+                                                 sqdepth=cv2.CV_64F)
+        integral, sq_integral = self._gray_integrals
+        
+        # Sommes exactes S = Σx et S2 = Σx² de chaque bloc
+        n = block_size * block_size
+        block_sums = self._block_sums(integral, block_size)
+        block_sq_sums = self._block_sums(sq_integral, block_size)
+        
+        # Variance = (n·S2 - S²) / n² : le numérateur est un entier calculé exactement,
+        # un bloc uniforme donne donc une variance exactement nulle
+        variance = (n * block_sq_sums - block_sums * block_sums) / (n * n)
+        texture_map = np.sqrt(variance)
                 
         return texture_map
     
-    def detect_optimal_regions(self, block_size=8, threshold_percentile=75):
+    def calculate_block_metrics(self, block_size=8):
         """
-        Identifie les régions optimales pour l'insertion de données en combinant
-        la densité des contours et la complexité de texture.
+        Calcule en un seul appel les deux métriques par bloc utilisées pour la
+        détection des zones optimales. Les résultats sont mémorisés par taille de
+        bloc, l'image n'étant plus modifiée après le chargement.
+        
+        Args:
+            block_size (int): Taille des blocs pour l'analyse
+            
+        Returns:
+            tuple: (carte de densité des contours, carte de complexité de texture)
+        """
+        if block_size in self._metrics_cache:
+            return self._metrics_cache[block_size]
+        
+        # Convertir l'image en niveaux de gris avant de lancer les tâches, pour
+        # qu'elle ne soit pas convertie une fois par tâche
+        self._ensure_gray_image()
+        
+        # Les deux calculs s'exécutent en parallèle (OpenCV libère le GIL)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            edge_future = executor.submit(self.calculate_edge_density, block_size)
+            texture_future = executor.submit(self.calculate_texture_complexity, block_size)
+            edge_map = edge_future.result()
+            texture_map = texture_future.result()
+        
+        self._metrics_cache[block_size] = (edge_map, texture_map)
+        return edge_map, texture_map
+    
+    def _mask_cache_path(self, block_size, threshold_percentile):
+        """
+        Construit le chemin du fichier de cache du masque pour ces paramètres.
+        
+        Args:
+            block_size (int): Taille des blocs pour l'analyse
+            threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
+            
+        Returns:
+            Path: Chemin du fichier .npz, ou None si le cache est désactivé
+        """
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"v{MASK_CACHE_VERSION}_{self.image_hash}_{block_size}_{threshold_percentile}.npz"
+    
+    def _load_cached_mask(self, block_size, threshold_percentile):
+        """
+        Charge le masque des zones optimales depuis le cache disque s'il existe.
+        
+        Args:
+            block_size (int): Taille des blocs pour l'analyse
+            threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
+            
+        Returns:
+            np.ndarray: Masque binaire des zones optimales, ou None s'il n'est pas en cache
+        """
+        cache_path = self._mask_cache_path(block_size, threshold_percentile)
+        if cache_path is None or not cache_path.is_file():
+            return None
+        
+        try:
+            with np.load(cache_path) as data:
+                mask = data["optimal_mask"]
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Cache illisible ou corrompu : le masque sera recalculé
+            return None
+        
+        # Un masque d'un autre format (flottant, 0/1, autre taille) est ignoré
+        if mask.dtype != np.uint8 or mask.shape != (self.height, self.width):
+            return None
+        return mask
+    
+    def _save_cached_mask(self, block_size, threshold_percentile, mask):
+        """
+        Enregistre le masque des zones optimales dans le cache disque.
+        
+        Args:
+            block_size (int): Taille des blocs pour l'analyse
+            threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
+            mask (np.ndarray): Masque binaire des zones optimales
+        """
+        cache_path = self._mask_cache_path(block_size, threshold_percentile)
+        if cache_path is None:
+            return
+        
+        tmp_path = None
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            # Écrire dans un fichier temporaire du même répertoire puis le renommer :
+            # un lecteur ne voit jamais de fichier partiellement écrit
+            with tempfile.NamedTemporaryFile(dir=cache_path.parent, suffix=".npz.tmp",
+                                             delete=False) as tmp_file:
+                tmp_path = tmp_file.name
+                np.savez_compressed(tmp_file, optimal_mask=mask)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Le cache est une optimisation : une erreur d'écriture n'est pas bloquante
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _compute_optimal_mask(self, block_size, threshold_percentile):
+        """
+        Calcule le masque binaire des zones optimales à partir des cartes d'analyse.
         
         Args:
             block_size (int): Taille des blocs pour l'analyse
             threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
             
         Returns:
-            tuple: (image originale avec zones optimales marquées, masque binaire des zones optimales)
+            np.ndarray: Masque binaire (0/255) à la taille de l'image
         """
         # Obtenir les cartes d'analyse
-        edge_map = self.calculate_edge_density(block_size)
-        texture_map = self.calculate_texture_complexity(block_size)
+        edge_map, texture_map = self.calculate_block_metrics(block_size)
         
-        # Combiner les deux métriques (pondération égale)
+        # Combiner les deux métriques (pondération égale). Aucune normalisation n'est
+        # nécessaire : le seuil par percentile est invariant par changement d'échelle
         combined_map = 0.5 * edge_map + 0.5 * texture_map
         
-        # Normaliser entre 0 et 1
-        combined_map = (combined_map - np.min(combined_map)) / (np.max(combined_map) - np.min(combined_map))
-        
         # Trouver les régions au-dessus du seuil (zones les plus complexes)
         threshold = np.percentile(combined_map, threshold_percentile)
         optimal_regions = combined_map >= threshold
         
-        # Créer un masque à la taille de l'image originale
+        # Créer un masque à la taille de l'image originale (agrandissement au plus proche
+        # voisin des blocs, les pixels hors blocs complets restant à 0)
+        h_blocks, w_blocks = optimal_regions.shape
+        mask_small = optimal_regions.astype(np.uint8) * 255
+        mask_blocks = cv2.resize(mask_small, (w_blocks * block_size, h_blocks * block_size),
+                                 interpolation=cv2.INTER_NEAREST)
         mask = np.zeros((self.height, self.width), dtype=np.uint8)
-        for y in range(optimal_regions.shape[0]):
-            for x in range(optimal_regions.shape[1]):
-                if optimal_regions[y, x]:
-                    y1, y2 = y * block_size, (y + 1) * block_size
-                    x1, x2 = x * block_size, (x + 1) * block_size
-                    mask[y1:y2, x1:x2] = 255
-        
-        # Créer une visualisation de l'image avec les zones optimales en surbrillance
-        highlighted_image = self.image_rgb.copy()
-        highlight_color = np.array([0, 255, 0], dtype=np.uint8)  # Vert
-        
-        for y in range(self.height):
-            for x in range(self.width):
-                if mask[y, x] == 255:
-                    # Appliquer une légère teinte verte aux pixels des zones optimales
-                    highlighted_image[y, x] = (highlighted_image[y, x] * 0.7 + highlight_color * 0.3).astype(np.uint8)
+        mask[:mask_blocks.shape[0], :mask_blocks.shape[1]] = mask_blocks
+        
+        return mask
+    
+    def detect_optimal_regions(self, block_size=8, threshold_percentile=75):
+        """
+        Identifie les régions optimales pour l'insertion de données en combinant
+        la densité des contours et la complexité de texture.
+        
+        Args:
+            block_size (int): Taille des blocs pour l'analyse
+            threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
+            
+        Returns:
+            tuple: (image originale BGR avec zones optimales marquées, masque binaire des zones optimales)
+        """
+        # Réutiliser le masque du cache disque si cette image a déjà été analysée
+        mask = self._load_cached_mask(block_size, threshold_percentile)
+        if mask is None:
+            mask = self._compute_optimal_mask(block_size, threshold_percentile)
+            self._save_cached_mask(block_size, threshold_percentile, mask)
+        
+        # Créer une visualisation de l'image avec les zones optimales en surbrillance,
+        # directement en BGR (la conversion RGB n'est faite que pour matplotlib)
+        highlight_color = np.array([0, 255, 0], dtype=np.uint8)  # Vert (identique en BGR)
+        green_layer = np.zeros_like(self.image)
+        green_layer[:] = highlight_color
+        
+        # Appliquer une légère teinte verte aux pixels des zones optimales
+        blended = cv2.addWeighted(self.image, 0.7, green_layer, 0.3, 0)
+        highlighted_image = np.where(mask[..., None] == 255, blended, self.image)
         
         return highlighted_image, mask
     
-    def visualize_analysis(self, block_size=8, threshold_percentile=75):
+    def visualize_analysis(self, block_size=8, threshold_percentile=75, backend='mpl'):
         """
         Visualise les résultats de l'analyse avec différentes métriques.
         
         Args:
             block_size (int): Taille des blocs pour l'analyse
             threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
+            backend (str): 'mpl' pour une figure matplotlib affichée à l'écran, ou 'cv2'
+                pour une mosaïque enregistrée directement avec OpenCV (sans affichage,
+                adaptée aux traitements par lots)
         """
-        # Obtenir les résultats
-        edge_map = self.calculate_edge_density(block_size)
-        texture_map = self.calculate_texture_complexity(block_size)
+        if backend not in ('mpl', 'cv2'):
+            raise ValueError(f"Backend de visualisation inconnu: {backend} (attendu: 'mpl' ou 'cv2')")
+        
+        # Obtenir les résultats (les cartes sont réutilisées par detect_optimal_regions)
+        edge_map, texture_map = self.calculate_block_metrics(block_size)
         highlighted_image, mask = self.detect_optimal_regions(block_size, threshold_percentile)
         
         # Calculer la capacité d'insertion potentielle (en octets)
         optimal_pixels = np.sum(mask) // 255
         capacity_bytes = optimal_pixels // 8  # 8 pixels = 1 octet (1 bit par pixel)
         capacity_percentage = (optimal_pixels / (self.height * self.width)) * 100
+        capacity_text = f"Capacité d'insertion potentielle: {capacity_bytes} octets ({capacity_percentage:.2f}% de l'image)"
+        
+        # Sauvegarder l'analyse
+        output_path = self.image_path.parent / f"{self.image_path.stem}_analysis.png"
+        if backend == 'cv2':
+            self._render_analysis_cv2(output_path, highlighted_image, edge_map, texture_map, capacity_text)
+        else:
+            self._render_analysis_mpl(output_path, highlighted_image, edge_map, texture_map, capacity_text)
+        
+        print(f"Analyse enregistrée sous: {output_path}")
+        print(capacity_text)
+        
+        return highlighted_image, mask, capacity_bytes
+    
+    def _render_analysis_mpl(self, output_path, highlighted_image, edge_map, texture_map, capacity_text):
+        """
+        Crée la figure d'analyse avec matplotlib, l'enregistre et l'affiche.
+        
+        Args:
+            output_path (Path): Chemin de sortie de la figure
+            highlighted_image (np.ndarray): Image BGR avec les zones optimales en surbrillance
+            edge_map (np.ndarray): Carte de densité des contours
+            texture_map (np.ndarray): Carte de complexité de texture
+            capacity_text (str): Texte décrivant la capacité d'insertion
+        """
+        # Import différé : matplotlib n'est nécessaire que pour ce rendu
+        import matplotlib.pyplot as plt
         
         # Créer la visualisation
         plt.figure(figsize=(15, 10))
@@ -165,7 +384,7 @@ class ImageAnalyzer:
         plt.axis('off')
         
         plt.subplot(2, 2, 2)
-        plt.imshow(highlighted_image)
+        plt.imshow(cv2.cvtColor(highlighted_image, cv2.COLOR_BGR2RGB))
         plt.title(f"Zones optimales pour insertion (vert)")
         plt.axis('off')
         
@@ -184,20 +403,54 @@ class ImageAnalyzer:
         plt.tight_layout()
         
         # Afficher les informations de capacité
-        plt.figtext(0.5, 0.01, 
-                   f"Capacité d'insertion potentielle: {capacity_bytes} octets ({capacity_percentage:.2f}% de l'image)",
+        plt.figtext(0.5, 0.01, capacity_text,
                    ha='center', fontsize=12, bbox={"facecolor":"orange", "alpha":0.2, "pad":5})
         
-        # Sauvegarder l'analyse
-        output_path = self.image_path.parent / f"{self.image_path.stem}_analysis.png"
         plt.savefig(output_path, dpi=300, bbox_inches='tight')
         plt.show()
+    
+    def _render_analysis_cv2(self, output_path, highlighted_image, edge_map, texture_map, capacity_text):
+        """
+        Compose les quatre panneaux de l'analyse dans une mosaïque 2x2 avec OpenCV
+        et l'enregistre en PNG, sans passer par matplotlib.
         
-        print(f"Analyse enregistrée sous: {output_path}")
-        print(f"Capacité d'insertion potentielle: {capacity_bytes} octets ({capacity_percentage:.2f}% de l'image)")
+        Args:
+            output_path (Path): Chemin de sortie de la mosaïque
+            highlighted_image (np.ndarray): Image BGR avec les zones optimales en surbrillance
+            edge_map (np.ndarray): Carte de densité des contours
+            texture_map (np.ndarray): Carte de complexité de texture
+            capacity_text (str): Texte décrivant la capacité d'insertion
+        """
+        h, w = self.height, self.width
         
-        return highlighted_image, mask, capacity_bytes
-
+        def colorize(metric_map, colormap):
+            # Mise à l'échelle 0-255 (comme l'échelle automatique de matplotlib),
+            # puis agrandissement au plus proche voisin à la taille de l'image
+            scaled = cv2.normalize(metric_map, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+            return cv2.resize(cv2.applyColorMap(scaled, colormap), (w, h),
+                              interpolation=cv2.INTER_NEAREST)
+        
+        # Mosaïque 2x2 en BGR, avec un bandeau en bas pour la capacité
+        banner_height = 40
+        canvas = np.zeros((2 * h + banner_height, 2 * w, 3), dtype=np.uint8)
+        canvas[:h, :w] = self.image
+        canvas[:h, w:] = highlighted_image
+        canvas[h:2 * h, :w] = colorize(edge_map, cv2.COLORMAP_HOT)
+        canvas[h:2 * h, w:] = colorize(texture_map, cv2.COLORMAP_VIRIDIS)
+        
+        # Titres (les polices Hershey d'OpenCV ne gèrent que l'ASCII)
+        titles = ["Image originale", "Zones optimales pour insertion (vert)",
+                  "Densite des contours", "Complexite de texture"]
+        origins = [(0, 0), (w, 0), (0, h), (w, h)]
+        for title, (x, y) in zip(titles, origins):
+            cv2.putText(canvas, title, (x + 10, y + 30), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.8, (255, 255, 255), 2, cv2.LINE_AA)
+        
+        banner_text = unicodedata.normalize('NFKD', capacity_text).encode('ascii', 'ignore').decode('ascii')
+        cv2.putText(canvas, banner_text, (10, 2 * h + 28), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.7, (0, 165, 255), 2, cv2.LINE_AA)
+        
+        cv2.imwrite(str(output_path), canvas, [cv2.IMWRITE_PNG_COMPRESSION, 1])
 
 def main():
     """Fonction principale pour tester l'analyseur d'image."""
@@ -11,14 +11,22 @@ import cv2
 import numpy as np
 from pathlib import Path
 import os
+import mmap
+import stat
 import struct
 from image_analyzer import ImageAnalyzer
 
+# Taille (en octets) de l'en-tête de longueur placé au début des données insérées
+PAYLOAD_HEADER_SIZE = 4
+
+# Plus grande valeur représentable dans un en-tête de longueur de 32 bits
+MAX_HEADER_VALUE = 0xFFFFFFFF
+
 
 class SteganographyEncoder:
     """Classe pour encoder des données secrètes dans une image en utilisant la stéganographie LSB."""
     
-    def __init__(self, image_path, block_size=16, threshold_percentile=75):
+    def __init__(self, image_path, block_size=16, threshold_percentile=75, analyzer=None):
         """
         Initialise l'encodeur de stéganographie.
         
@@ -26,13 +34,21 @@ class SteganographyEncoder:
             image_path (str): Chemin vers l'image à utiliser
             block_size (int): Taille des blocs pour l'analyse des zones optimales
             threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
+            analyzer (ImageAnalyzer, optional): Analyseur déjà construit pour cette image
         """
         self.image_path = Path(image_path)
         self.block_size = block_size
         self.threshold_percentile = threshold_percentile
         
+        # Un analyseur fourni doit porter sur la même image : les pixels et le masque
+        # viennent de l'analyseur, le chemin de sortie par défaut de image_path
+        if analyzer is not None and analyzer.image_path.resolve() != self.image_path.resolve():
+            raise ValueError(
+                f"L'analyseur porte sur l'image {analyzer.image_path}, et non sur {image_path}."
+            )
+        
         # Initialiser l'analyseur d'image pour trouver les zones optimales
-        self.analyzer = ImageAnalyzer(image_path)
+        self.analyzer = analyzer if analyzer is not None else ImageAnalyzer(image_path)
         
         # Obtenir l'image et le masque des zones optimales
         _, self.optimal_mask = self.analyzer.detect_optimal_regions(
@@ -40,111 +56,156 @@ class SteganographyEncoder:
             threshold_percentile=self.threshold_percentile
         )
         
-        # Calculer la capacité d'insertion (en octets)
-        optimal_pixels = np.sum(self.optimal_mask) // 255
-        self.capacity = optimal_pixels * 3 // 8  # 3 canaux, 1 bit par canal, 8 bits par octet
-        
-        # Charger l'image en mode BGR pour le traitement
-        self.image = cv2.imread(str(image_path))
+        # Réutiliser l'image BGR déjà chargée par l'analyseur
+        self.image = self.analyzer.image
         
         # Dimensions de l'image
         self.height, self.width, self.channels = self.image.shape
         
-        # Liste des coordonnées optimales pour l'insertion (dans l'ordre)
-        self.optimal_pixels = self._get_optimal_pixels()
+        # Calculer la capacité d'insertion sans construire la liste des coordonnées
+        # (1 bit par canal, les coordonnées ne sont calculées qu'à l'insertion)
+        optimal_pixels = int(np.count_nonzero(self.optimal_mask == 255))
+        self.capacity_bits = optimal_pixels * self.channels
+        self.capacity = self.capacity_bits // 8  # 8 bits par octet
         
-    def _get_optimal_pixels(self):
+    @classmethod
+    def from_analyzer(cls, analyzer, block_size=16, threshold_percentile=75):
         """
-        Obtient les coordonnées de tous les pixels optimaux selon le masque.
+        Crée un encodeur à partir d'un analyseur existant, afin de partager le
+        chargement de l'image et les cartes d'analyse entre plusieurs encodeurs.
         
+        Args:
+            analyzer (ImageAnalyzer): Analyseur de l'image à utiliser
+            block_size (int): Taille des blocs pour l'analyse des zones optimales
+            threshold_percentile (int): Percentile pour déterminer le seuil des zones optimales
+            
         Returns:
-            list: Liste de tuples (y, x, c) représentant les coordonnées des pixels optimaux
-                  et leur canal (0=B, 1=G, 2=R)
+            SteganographyEncoder: Encodeur associé à l'image de l'analyseur
         """
-        optimal_coords = []
-        
-        # Pour chaque pixel optimal, nous pouvons utiliser les 3 canaux (B, G, R)
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.optimal_mask[y, x] == 255:  # Si c'est un pixel optimal
-                    for c in range(self.channels):
-                        optimal_coords.append((y, x, c))
-        
-        return optimal_coords
-        
-    def _text_to_bits(self, text):
+        return cls(analyzer.image_path, block_size=block_size,
+                   threshold_percentile=threshold_percentile, analyzer=analyzer)
+    
+    def _get_optimal_pixels(self, n_bits):
         """
-        Convertit un texte en une chaîne de bits.
+        Obtient, dans l'ordre d'insertion, les positions des n_bits premiers
+        emplacements optimaux selon le masque.
         
         Args:
-            text (str): Texte à convertir
+            n_bits (int): Nombre d'emplacements (bits) nécessaires
             
         Returns:
-            str: Chaîne de bits (ex: '101010101...')
+            np.ndarray: Tableau 1D d'indices dans l'image aplatie (hauteur × largeur × canaux) ;
+                  l'indice (y * largeur + x) * canaux + c désigne le canal c (0=B, 1=G, 2=R)
+                  du pixel optimal (y, x)
         """
-        # Convertir le texte en bytes
-        text_bytes = text.encode('utf-8')
+        # Indices des pixels optimaux, dans l'ordre de parcours ligne par ligne
+        # (limités au nombre de pixels réellement nécessaires)
+        n_pixels = -(-n_bits // self.channels)
+        pixel_indices = np.flatnonzero(self.optimal_mask == 255)[:n_pixels]
         
-        # Convertir chaque byte en bits
-        bits = ''.join([format(byte, '08b') for byte in text_bytes])
+        # Pour chaque pixel optimal, nous pouvons utiliser les 3 canaux (B, G, R)
+        channel_offsets = np.arange(self.channels)
+        optimal_indices = (pixel_indices[:, None] * self.channels + channel_offsets).ravel()
         
-        return bits
-    
-    def _file_to_bits(self, file_path):
+        return optimal_indices[:n_bits]
+        
+    def _file_to_bytes(self, file_path):
         """
-        Convertit un fichier binaire en une chaîne de bits.
+        Construit les données à cacher pour un fichier (nom et contenu).
         
         Args:
             file_path (str): Chemin vers le fichier à convertir
             
         Returns:
-            str: Chaîne de bits (ex: '101010101...')
+            bytearray: Nom et contenu du fichier précédés de leurs longueurs
         """
-        with open(file_path, 'rb') as f:
-            file_bytes = f.read()
-        
         # Obtenir le nom du fichier (pour le stockage)
         file_name = os.path.basename(file_path)
         file_name_bytes = file_name.encode('utf-8')
         
         # Structure: [taille du nom (4 bytes)][nom du fichier][taille des données (4 bytes)][données]
         name_length = len(file_name_bytes)
-        data_length = len(file_bytes)
+        header_end = 4 + name_length + 4
         
-        # Convertir les longueurs en bytes (format little-endian)
-        name_length_bytes = struct.pack('<I', name_length)
-        data_length_bytes = struct.pack('<I', data_length)
+        with open(file_path, 'rb') as f:
+            file_stat = os.fstat(f.fileno())
+            
+            # Seul un fichier régulier non vide a une taille fiable et peut être projeté
+            # en mémoire ; les autres (FIFO, /proc, périphériques...) sont lus entièrement
+            if stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0:
+                file_data = None
+                data_length = file_stat.st_size
+            else:
+                file_data = f.read()
+                data_length = len(file_data)
+            
+            if data_length > MAX_HEADER_VALUE:
+                raise ValueError(f"Le fichier {file_path} est trop volumineux ({data_length} octets).")
+            
+            # Écrire toutes les informations dans un tampon préalloué à la taille exacte
+            # (longueurs au format little-endian), sans concaténations intermédiaires
+            all_bytes = bytearray(header_end + data_length)
+            struct.pack_into('<I', all_bytes, 0, name_length)
+            all_bytes[4:4 + name_length] = file_name_bytes
+            struct.pack_into('<I', all_bytes, 4 + name_length, data_length)
+            
+            if file_data is not None:
+                all_bytes[header_end:] = file_data
+            else:
+                # Copier les données directement depuis le fichier projeté en mémoire
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # Le fichier ne doit pas avoir changé de taille depuis le calcul de l'en-tête
+                    if len(mm) != data_length:
+                        raise ValueError(f"Le fichier {file_path} a été modifié pendant sa lecture.")
+                    all_bytes[header_end:] = mm
+        
+        return all_bytes
+    
+    def _build_payload(self, data_bytes):
+        """
+        Construit le tableau de bits à insérer : la longueur des données en bits
+        (32 bits, poids fort en premier) suivie des données elles-mêmes.
         
-        # Combiner toutes les informations
-        all_bytes = name_length_bytes + file_name_bytes + data_length_bytes + file_bytes
+        Args:
+            data_bytes (bytes): Données à cacher
+            
+        Returns:
+            np.ndarray: Tableau uint8 de bits (valeurs 0/1, bit de poids fort en premier)
+        """
+        # La longueur en bits doit tenir dans l'en-tête de 32 bits
+        data_bits_count = len(data_bytes) * 8
+        if data_bits_count > MAX_HEADER_VALUE:
+            raise ValueError(
+                f"Les données sont trop volumineuses ({len(data_bytes)} octets) pour l'en-tête de longueur de 32 bits."
+            )
         
-        # Convertir en bits
-        bits = ''.join([format(byte, '08b') for byte in all_bytes])
+        # Écrire l'en-tête de longueur et les données dans un tampon préalloué
+        payload = bytearray(PAYLOAD_HEADER_SIZE + len(data_bytes))
+        struct.pack_into('>I', payload, 0, data_bits_count)
+        payload[PAYLOAD_HEADER_SIZE:] = data_bytes
         
-        return bits
+        # Convertir en bits en une seule opération
+        return np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
     
-    def _check_capacity(self, data_bits):
+    def _check_capacity(self, payload_bits):
         """
         Vérifie si l'image a une capacité suffisante pour insérer les données.
         
         Args:
-            data_bits (str): Chaîne de bits à insérer
+            payload_bits (np.ndarray): Tableau de bits à insérer (en-tête de longueur inclus)
             
         Returns:
             bool: True si la capacité est suffisante, False sinon
         """
-        # Ajouter 32 bits pour stocker la longueur des données
-        total_bits = len(data_bits) + 32
-        
         # Vérifier la capacité (nombre de pixels optimaux)
-        return total_bits <= len(self.optimal_pixels)
+        return payload_bits.size <= self.capacity_bits
         
-    def _embed_bits_lsb(self, bits):
+    def _embed_bits_lsb(self, payload_bits):
         """
         Intègre les bits dans l'image en utilisant la technique LSB.
         
         Args:
-            bits (str): Chaîne de bits à insérer
+            payload_bits (np.ndarray): Tableau de bits à insérer (en-tête de longueur inclus)
             
         Returns:
             np.ndarray: Image avec les données intégrées
@@ -152,49 +213,57 @@ class SteganographyEncoder:
         # Créer une copie de l'image pour ne pas modifier l'original
         stego_image = self.image.copy()
         
-        # Ajouter la longueur des données au début (32 bits)
-        length_bits = format(len(bits), '032b')
-        all_bits = length_bits + bits
-        
-        total_bits = len(all_bits)
+        total_bits = payload_bits.size
         
         # Vérifier la capacité une dernière fois
-        if total_bits > len(self.optimal_pixels):
-            raise ValueError(f"Capacité insuffisante. Besoin de {total_bits} bits, mais seulement {len(self.optimal_pixels)} disponibles.")
-        
-        # Insérer chaque bit dans le LSB des pixels optimaux
-        for i, bit in enumerate(all_bits):
-            if i >= len(self.optimal_pixels):
-                break
-                
-            y, x, c = self.optimal_pixels[i]
-            
-            # Modifier le bit le moins significatif du pixel
-            pixel_value = stego_image[y, x, c]
-            
-            # Effacer le LSB et définir la nouvelle valeur
-            new_value = (pixel_value & 0xFE) | int(bit)
-            stego_image[y, x, c] = new_value
+        if total_bits > self.capacity_bits:
+            raise ValueError(f"Capacité insuffisante. Besoin de {total_bits} bits, mais seulement {self.capacity_bits} disponibles.")
+        
+        # Positions des pixels optimaux utilisés, dans l'ordre d'insertion
+        indices = self._get_optimal_pixels(total_bits)
+        
+        # Effacer le LSB des pixels optimaux et y écrire les bits en une seule opération,
+        # via une vue 1D de la copie (contiguë) pour éviter l'indexation sur trois axes
+        flat_image = stego_image.reshape(-1)
+        flat_image[indices] = (flat_image[indices] & 0xFE) | payload_bits
             
         return stego_image
     
-    def encode_text(self, secret_text, output_path=None):
+    def _write_png(self, output_path, image, compression_level):
+        """
+        Enregistre l'image au format PNG avec le niveau de compression demandé.
+        
+        Args:
+            output_path (str): Chemin de sortie de l'image
+            image (np.ndarray): Image BGR à enregistrer
+            compression_level (int): Niveau de compression PNG (0-9)
+        """
+        params = [
+            cv2.IMWRITE_PNG_COMPRESSION, compression_level,
+            cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+        ]
+        cv2.imwrite(output_path, image, params)
+    
+    def encode_text(self, secret_text, output_path=None, compression_level=1):
         """
         Encode un texte secret dans l'image en utilisant les zones optimales.
         
         Args:
             secret_text (str): Texte à cacher dans l'image
             output_path (str, optional): Chemin de sortie pour l'image stéganographiée
+            compression_level (int): Niveau de compression PNG (0-9, sans perte ;
+                plus bas = écriture plus rapide, fichier plus volumineux)
             
         Returns:
             str: Chemin de l'image stéganographiée
         """
-        # Convertir le texte en bits
-        text_bits = self._text_to_bits(secret_text)
+        # Convertir le texte en bits (en-tête de longueur inclus)
+        text_bytes = secret_text.encode('utf-8')
+        text_len_bytes = len(text_bytes)
+        text_bits = self._build_payload(text_bytes)
         
         # Vérifier la capacité
         if not self._check_capacity(text_bits):
-            text_len_bytes = len(text_bits) // 8
             raise ValueError(
                 f"Le texte est trop long ({text_len_bytes} octets) pour la capacité de l'image ({self.capacity} octets)."
             )
@@ -207,20 +276,22 @@ class SteganographyEncoder:
             output_path = str(self.image_path.parent / f"{self.image_path.stem}_stego.png")
         
         # Enregistrer l'image
-        cv2.imwrite(output_path, stego_image)
+        self._write_png(output_path, stego_image, compression_level)
         
         print(f"Message caché avec succès dans: {output_path}")
-        print(f"Taille du message: {len(text_bits) // 8} octets")
+        print(f"Taille du message: {text_len_bytes} octets")
         
         return output_path
     
-    def encode_file(self, file_path, output_path=None):
+    def encode_file(self, file_path, output_path=None, compression_level=1):
         """
         Encode un fichier dans l'image en utilisant les zones optimales.
         
         Args:
             file_path (str): Chemin vers le fichier à cacher
             output_path (str, optional): Chemin de sortie pour l'image stéganographiée
+            compression_level (int): Niveau de compression PNG (0-9, sans perte ;
+                plus bas = écriture plus rapide, fichier plus volumineux)
             
         Returns:
             str: Chemin de l'image stéganographiée
@@ -229,12 +300,24 @@ class SteganographyEncoder:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Le fichier {file_path} n'existe pas.")
         
-        # Convertir le fichier en bits
-        file_bits = self._file_to_bits(file_path)
+        # Vérifier la capacité avant de lire le fichier, quand sa taille est connue
+        # (fichier régulier) : un fichier trop volumineux n'est jamais chargé en mémoire
+        file_stat = os.stat(file_path)
+        if stat.S_ISREG(file_stat.st_mode):
+            name_length = len(os.path.basename(file_path).encode('utf-8'))
+            file_len_bytes = 4 + name_length + 4 + file_stat.st_size
+            if (PAYLOAD_HEADER_SIZE + file_len_bytes) * 8 > self.capacity_bits:
+                raise ValueError(
+                    f"Le fichier est trop volumineux ({file_len_bytes} octets) pour la capacité de l'image ({self.capacity} octets)."
+                )
+        
+        # Convertir le fichier en bits (en-tête de longueur inclus)
+        file_bytes = self._file_to_bytes(file_path)
+        file_len_bytes = len(file_bytes)
+        file_bits = self._build_payload(file_bytes)
         
         # Vérifier la capacité
         if not self._check_capacity(file_bits):
-            file_len_bytes = len(file_bits) // 8
             raise ValueError(
                 f"Le fichier est trop volumineux ({file_len_bytes} octets) pour la capacité de l'image ({self.capacity} octets)."
             )
@@ -247,10 +330,10 @@ class SteganographyEncoder:
             output_path = str(self.image_path.parent / f"{self.image_path.stem}_stego.png")
         
         # Enregistrer l'image
-        cv2.imwrite(output_path, stego_image)
+        self._write_png(output_path, stego_image, compression_level)
         
         print(f"Fichier caché avec succès dans: {output_path}")
-        print(f"Taille du fichier: {len(file_bits) // 8} octets")
+        print(f"Taille du fichier: {file_len_bytes} octets")
         
         return output_path
 